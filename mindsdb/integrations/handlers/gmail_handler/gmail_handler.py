@@ -1,7 +1,18 @@
+import hashlib
+import importlib.util
 import json
 from shutil import copyfile
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, token writes are not locked there
+    fcntl = None
 
 from mindsdb.integrations.libs.response import (
     HandlerStatusResponse as StatusResponse,
@@ -15,20 +26,92 @@ from mindsdb_sql import parse_sql
 
 import os
 import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import List
 import pandas as pd
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from email.message import EmailMessage
-
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 
-DEFAULT_SCOPES = ['https://www.googleapis.com/auth/gmail.compose',
-                  'https://www.googleapis.com/auth/gmail.readonly']
+# The google client libraries are slow to import, so they are only imported once
+# the handler is used. Missing libraries are still reported when it is loaded
+for _module in ('googleapiclient', 'google_auth_httplib2', 'google_auth_oauthlib'):
+    if importlib.util.find_spec(_module) is None:
+        raise ImportError(f"No module named '{_module}'")
+
+DEFAULT_SCOPES = ('https://www.googleapis.com/auth/gmail.compose',
+                  'https://www.googleapis.com/auth/gmail.readonly')
+
+S3_CHUNK_SIZE = 64 * 1024
+
+
+def _create_s3_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=3, backoff_factor=0.3))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared so that connections to S3 are kept alive between downloads
+_S3_SESSION = _create_s3_session()
+
+# Authenticated services shared by all handler instances, keyed by a hash
+# of the credentials they were created from
+_SERVICE_CACHE = {}
+
+# Credentials loaded from token files, keyed by token file path and scopes
+_TOKEN_CACHE = {}
+
+# Requests rejected by the per-user rate limit are retried with an exponential backoff, in seconds
+MAX_RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_BACKOFF = 1
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+HTTP_TIMEOUT = 30
+
+# Columns filled from each format of the "users.messages.get" API
+MINIMAL_FORMAT_COLUMNS = {'id', 'thread_id', 'label_ids'}
+FULL_FORMAT_COLUMNS = {'body', 'attachments'}
+METADATA_HEADERS = ['From', 'To', 'Subject', 'Date', 'Message-Id']
+
+# Email headers stored in the emails table, mapped to their column
+HEADER_COLUMNS = {
+    'to': 'to',
+    'subject': 'subject',
+    'date': 'date',
+    'from': 'sender',
+    'message-id': 'message_id',
+}
+
+
+def _is_rate_limited(exception) -> bool:
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(exception, HttpError):
+        return False
+
+    status = exception.resp.status
+    return status == 429 or (status == 403 and any(reason in exception.content for reason in RATE_LIMIT_REASONS))
+
+
+def _row_size(row) -> int:
+    # Approximation of the memory held by a parsed message, dominated by its text
+    return sum(len(value) for value in row.values() if isinstance(value, str))
+
+
+def _iter_parts(parts):
+    """Yields the leaf parts of a Gmail message parts tree, in the order they appear in the email"""
+    stack = list(reversed(parts))
+    while stack:
+        part = stack.pop()
+        if part['mimeType'] != 'text/plain' and (part['mimeType'] == 'multipart/alternative' or 'parts' in part):
+            stack.extend(reversed(part.get('parts', [])))
+        else:
+            yield part
 
 
 class EmailsTable(APITable):
@@ -78,11 +161,6 @@ class EmailsTable(APITable):
         if query.limit is not None:
             params['maxResults'] = query.limit.value
 
-        result = self.handler.call_gmail_api(
-            method_name='list_messages',
-            params=params
-        )
-
         # filter targets
         columns = []
         for target in query.targets:
@@ -97,20 +175,26 @@ class EmailsTable(APITable):
         # columns to lower case
         columns = [name.lower() for name in columns]
 
+        result = self.handler.call_gmail_api(
+            method_name='list_messages',
+            params=params,
+            columns=columns
+        )
+
         if len(result) == 0:
             return pd.DataFrame([], columns=columns)
 
-        # add absent columns
-        for col in set(columns) & set(result.columns) ^ set(columns):
-            result[col] = None
-
-        # filter by columns
-        result = result[columns]
+        # filter by columns, adding absent ones
+        result = result.reindex(columns=columns)
 
-        # Rename columns
-        for target in query.targets:
-            if target.alias:
-                result.rename(columns={target.parts[-1]: str(target.alias)}, inplace=True)
+        # Rename columns, their names are lower case at this point
+        aliases = {
+            target.parts[-1].lower(): str(target.alias)
+            for target in query.targets
+            if isinstance(target, ast.Identifier) and target.alias
+        }
+        if aliases:
+            result.rename(columns=aliases, inplace=True)
 
         return result
 
@@ -151,6 +235,8 @@ class EmailsTable(APITable):
         ValueError
             If the query contains an unsupported condition
         """
+        from email.message import EmailMessage
+
         columns = [col.name for col in query.columns]
 
         supported_columns = {"message_id", "thread_id", "to_email", "subject", "body"}
@@ -208,11 +294,26 @@ class GmailHandler(APIHandler):
 
         self.s3_credentials_file = self.connection_args.get('s3_credentials_file', None)
         self.credentials_file = self.connection_args.get('credentials_file', None)
-        self.scopes = self.connection_args.get('scopes', DEFAULT_SCOPES)
+        scopes = self.connection_args.get('scopes', DEFAULT_SCOPES)
+        # Kept as a tuple so it can be part of cache keys
+        self.scopes = (scopes,) if isinstance(scopes, str) else tuple(scopes)
         self.token_file = None
         self.max_page_size = 500
-        self.max_batch_size = 100
+        # Gmail rate limits batches of more than 50 requests
+        self.max_batch_size = 50
+        # Keeps concurrent batches close to Gmail's per-user quota, requests
+        # over it are retried
+        self.max_batch_workers = 2
         self.service = None
+        self.credentials = None
+        self._http_pool = queue.SimpleQueue()
+        # Parsed messages fetched with the full format, keyed by message id
+        self._message_cache = OrderedDict()
+        self._message_cache_size = 0
+        self._message_cache_lock = threading.Lock()
+        self.max_cached_messages = 10000
+        # Bounds the memory used by cached bodies, in characters of text
+        self.max_cached_size = 50 * 1024 * 1024
         self.is_connected = False
 
         emails = EmailsTable(self)
@@ -222,21 +323,70 @@ class GmailHandler(APIHandler):
     def _has_creds_file(self, creds_file):
         # Giving more priority to the S3 file
         if self.s3_credentials_file:
-            response = requests.get(self.s3_credentials_file)
-            if response.status_code == 200:
-                with open(creds_file, 'w') as creds:
-                    creds.write(response.text)
-
-                return True
-            else:
-                log.logger.error("Failed to get credentials from S3", response.status_code)
+            with _S3_SESSION.get(self.s3_credentials_file, stream=True) as response:
+                if response.status_code == 200:
+                    # Written aside first, so that an interrupted download can't leave a
+                    # partial creds.json, which would be used as is on the next connection
+                    with open(creds_file + '.tmp', 'wb') as creds:
+                        for chunk in response.iter_content(chunk_size=S3_CHUNK_SIZE):
+                            creds.write(chunk)
+                    os.replace(creds_file + '.tmp', creds_file)
+
+                    return True
+                else:
+                    log.logger.error("Failed to get credentials from S3", response.status_code)
 
         if self.credentials_file and os.path.isfile(self.credentials_file):
             copyfile(self.credentials_file, creds_file)
             return True
 
+    def _load_token(self, token_file):
+        from google.oauth2.credentials import Credentials
+
+        try:
+            mtime = os.path.getmtime(token_file)
+        except OSError:
+            return None
+
+        # The token file is only read again if it was changed since it was last loaded
+        cache_key = (token_file, self.scopes)
+        cached = _TOKEN_CACHE.get(cache_key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(token_file) as token:
+            if fcntl is not None:
+                fcntl.flock(token, fcntl.LOCK_SH)
+            info = json.load(token)
+
+        creds = Credentials.from_authorized_user_info(info, self.scopes)
+        _TOKEN_CACHE[cache_key] = (mtime, creds, (creds.token, creds.expiry))
+        return creds
+
+    def _save_token(self, token_file, creds):
+        # Nothing to write if the token didn't change since it was loaded or saved
+        cache_key = (token_file, self.scopes)
+        cached = _TOKEN_CACHE.get(cache_key)
+        if cached is not None and cached[1] is creds and cached[2] == (creds.token, creds.expiry):
+            return
+
+        # The file is truncated only once the lock is held, so concurrent
+        # writers from other processes can't interleave their writes
+        with open(token_file, 'a') as token:
+            if fcntl is not None:
+                fcntl.flock(token, fcntl.LOCK_EX)
+            token.seek(0)
+            token.truncate()
+            token.write(creds.to_json())
+
+        _TOKEN_CACHE[cache_key] = (os.path.getmtime(token_file), creds, (creds.token, creds.expiry))
+
     def create_connection(self) -> object:
-        creds = None
+        import httplib2
+        from google.auth.transport.requests import Request
+        from google_auth_httplib2 import AuthorizedHttp
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from googleapiclient.discovery import build
 
         # Get the current dir, we'll check for Token & Creds files in this dir
         curr_dir = os.path.dirname(__file__)
@@ -244,8 +394,7 @@ class GmailHandler(APIHandler):
         token_file = os.path.join(curr_dir, 'token.json')
         creds_file = os.path.join(curr_dir, 'creds.json')
 
-        if os.path.isfile(token_file):
-            creds = Credentials.from_authorized_user_file(token_file, self.scopes)
+        creds = self._load_token(token_file)
 
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
@@ -257,10 +406,17 @@ class GmailHandler(APIHandler):
                 creds = flow.run_local_server(port=0, timeout_seconds=120)
 
         # Save the credentials for the next run
-        with open(token_file, 'w') as token:
-            token.write(creds.to_json())
+        self._save_token(token_file, creds)
+
+        self.credentials = creds
+        # The discovery document shipped with the client library is used, so
+        # no request is made to fetch it
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        return build('gmail', 'v1', http=http, cache_discovery=False, static_discovery=True)
 
-        return build('gmail', 'v1', credentials=creds)
+    def _get_cache_key(self):
+        key = json.dumps([self.credentials_file, self.s3_credentials_file, sorted(self.scopes)])
+        return hashlib.sha256(key.encode()).hexdigest()
 
     def connect(self) -> object:
         """Authenticate with the Gmail API using the credentials file.
@@ -273,10 +429,20 @@ class GmailHandler(APIHandler):
         if self.is_connected and self.service is not None:
             return self.service
 
-        try:
-            self.service = self.create_connection()
-        except Exception as e:
-            raise Exception(f'Error connecting to Gmail API: {e}')
+        cache_key = self._get_cache_key()
+        cached = _SERVICE_CACHE.get(cache_key)
+        if cached is not None and cached[0].valid:
+            self.credentials, self.service = cached
+        else:
+            try:
+                self.service = self.create_connection()
+            except Exception as e:
+                raise Exception(f'Error connecting to Gmail API: {e}')
+
+            _SERVICE_CACHE[cache_key] = (self.credentials, self.service)
+
+        # Pooled connections are bound to the credentials they were created with
+        self._http_pool = queue.SimpleQueue()
 
         self.is_connected = True
         return self.service
@@ -289,13 +455,15 @@ class GmailHandler(APIHandler):
         StatusResponse
             Status confirmation
         """
+        from googleapiclient.errors import HttpError
+
         response = StatusResponse(False)
 
         try:
             # Call the Gmail API
             service = self.connect()
 
-            result = service.users().getProfile(userId='me').execute()
+            result = self._execute(service.users().getProfile(userId='me'))
 
             if result and result.get('emailAddress', None) is not None:
                 response.success = True
@@ -317,32 +485,31 @@ class GmailHandler(APIHandler):
         if not parts:
             return
 
-        body = ''
-        for part in parts:
-            if part['mimeType'] == 'text/plain':
-                part_body = part.get('body', {}).get('data', '')
-                body += urlsafe_b64decode(part_body).decode('utf-8')
-            elif part['mimeType'] == 'multipart/alternative' or 'parts' in part:
-                # Recursively iterate over nested parts to find the plain text body
-                body += self._parse_parts(part['parts'], attachments)
-            elif part.get('filename') and part.get('body') and part.get('body').get('attachmentId'):
+        body = []
+        for part in _iter_parts(parts):
+            mime_type = part['mimeType']
+            part_body = part.get('body', {})
+
+            if mime_type == 'text/plain':
+                data = part_body.get('data')
+                if data:
+                    body.append(urlsafe_b64decode(data))
+            elif part.get('filename') and part_body.get('attachmentId'):
                 # For now just store the attachment details
                 attachments.append({
                     'filename': part['filename'],
-                    'mimeType': part['mimeType'],
-                    'attachmentId': part['body']['attachmentId']
+                    'mimeType': mime_type,
+                    'attachmentId': part_body['attachmentId']
                 })
             else:
-                log.logger.debug(f"Unhandled mimeType: {part['mimeType']}")
+                log.logger.debug(f"Unhandled mimeType: {mime_type}")
 
-        return body
+        # Decoded once for the whole body rather than once per part
+        return b''.join(body).decode('utf-8', errors='replace')
 
-    def _parse_message(self, data, message, exception):
-        if exception:
-            log.logger.error(f'Exception in getting full email: {exception}')
-            return
-
-        payload = message['payload']
+    def _parse_message(self, message):
+        # Only the full format has the parts, and the minimal format has no payload at all
+        payload = message.get('payload', {})
         headers = payload.get("headers", [])
         parts = payload.get("parts")
 
@@ -351,101 +518,223 @@ class GmailHandler(APIHandler):
             'thread_id': message['threadId'],
             'label_ids': message.get('labelIds', []),
             'snippet': message.get('snippet', ''),
-            'history_id': message['historyId'],
+            'history_id': message.get('historyId'),
             'size_estimate': message.get('sizeEstimate', 0),
         }
 
         for header in headers:
             key = header['name'].lower()
-            value = header['value']
-
-            if key in ['to', 'subject', 'date']:
-                row[key] = value
-            elif key == 'from':
-                row['sender'] = value
-            elif key == 'message-id':
-                row['message_id'] = value
+            if key in HEADER_COLUMNS:
+                row[HEADER_COLUMNS[key]] = header['value']
 
         attachments = []
         row['body'] = self._parse_parts(parts, attachments)
-        row['attachments'] = json.dumps(attachments)
-        data.append(row)
+        # Compact JSON, with non-ASCII characters written as UTF-8 instead of \uXXXX escapes
+        row['attachments'] = orjson.dumps(attachments).decode()
+
+        return row
+
+    def _new_columns(self):
+        # Rows are accumulated column by column, which lets pandas build
+        # the DataFrame from whole columns instead of inferring it row by row
+        return {column: [] for column in self.emails.get_columns()}
+
+    def _get_message_format(self, columns):
+        # Bodies are only downloaded when they are selected
+        if columns is None or FULL_FORMAT_COLUMNS.intersection(columns):
+            return {'format': 'full'}
+        elif MINIMAL_FORMAT_COLUMNS.issuperset(columns):
+            return {'format': 'minimal'}
+        else:
+            return {'format': 'metadata', 'metadataHeaders': METADATA_HEADERS}
+
+    def _get_messages(self, messages, message_format):
+        rows = {}
+        cached_rows = {}
+        rate_limited = []
+
+        # Only full messages are cached, minimal and metadata ones are about as
+        # cheap to fetch again as to refresh
+        use_cache = message_format['format'] == 'full'
+        if use_cache:
+            with self._message_cache_lock:
+                for message in messages:
+                    if message['id'] in self._message_cache:
+                        self._message_cache.move_to_end(message['id'])
+                        cached_rows[message['id']] = self._message_cache[message['id']][0]
+
+        def add_row(message_id, response, exception):
+            if _is_rate_limited(exception):
+                # Messages the per-user rate limit was hit for are retried instead of being skipped
+                rate_limited.append(message_id)
+            elif exception:
+                log.logger.error(f'Exception in getting full email: {exception}')
+            elif message_id in cached_rows:
+                # The content of a message never changes, only its labels do
+                rows[message_id] = dict(
+                    cached_rows[message_id],
+                    label_ids=response.get('labelIds', []),
+                    history_id=response.get('historyId')
+                )
+            else:
+                rows[message_id] = self._parse_message(response)
+
+        get_message = self.service.users().messages().get
+        message_ids = [message['id'] for message in messages]
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            if attempt:
+                time.sleep(RATE_LIMIT_BACKOFF * 2 ** (attempt - 1))
+
+            batch_req = self.service.new_batch_http_request(add_row)
+            for message_id in message_ids:
+                # Cached messages are only fetched again for their labels
+                params = {'format': 'minimal'} if message_id in cached_rows else message_format
+                batch_req.add(get_message(userId='me', id=message_id, **params), request_id=message_id)
+
+            self._execute(batch_req)
+            if not rate_limited:
+                break
+
+            message_ids = rate_limited[:]
+            rate_limited.clear()
+        else:
+            raise RuntimeError(f'Gmail API rate limit exceeded, {len(message_ids)} emails could not be fetched')
+
+        if use_cache:
+            with self._message_cache_lock:
+                for message_id, row in rows.items():
+                    if message_id in self._message_cache:
+                        self._message_cache_size -= self._message_cache.pop(message_id)[1]
+
+                    size = _row_size(row)
+                    self._message_cache[message_id] = (row, size)
+                    self._message_cache_size += size
 
-    def _get_messages(self, data, messages):
-        batch_req = self.service.new_batch_http_request(
-            lambda id, response, exception: self._parse_message(data, response, exception))
+                while self._message_cache and (
+                    len(self._message_cache) > self.max_cached_messages
+                    or self._message_cache_size > self.max_cached_size
+                ):
+                    self._message_cache_size -= self._message_cache.popitem(last=False)[1][1]
+
+        data = self._new_columns()
         for message in messages:
-            batch_req.add(self.service.users().messages().get(userId='me', id=message['id']))
+            row = rows.get(message['id'])
+            if row is not None:
+                for column, values in data.items():
+                    values.append(row.get(column))
+
+        return data
+
+    def _handle_list_messages_response(self, data, messages, message_format):
+        batches = [
+            messages[start:start + self.max_batch_size]
+            for start in range(0, len(messages), self.max_batch_size)
+        ]
+
+        # Batches are independent, so they are fetched concurrently. Each one
+        # collects its own rows, which are then merged in order
+        with ThreadPoolExecutor(max_workers=self.max_batch_workers) as executor:
+            for columns in executor.map(lambda batch: self._get_messages(batch, message_format), batches):
+                for column, values in columns.items():
+                    data[column].extend(values)
+
+    @contextmanager
+    def _borrow_http(self):
+        # httplib2.Http is not thread safe, so every concurrent request borrows
+        # its own connection. Connections are returned to the pool afterwards,
+        # keeping them alive for the following requests and batches
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
 
-        batch_req.execute()
+        try:
+            http = self._http_pool.get_nowait()
+        except queue.Empty:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+
+        try:
+            yield http
+        finally:
+            self._http_pool.put(http)
 
-    def _handle_list_messages_response(self, data, messages):
-        total_pages = len(messages) // self.max_batch_size
-        for page in range(total_pages):
-            self._get_messages(data, messages[page * self.max_batch_size:(page + 1) * self.max_batch_size])
+    def _execute(self, request):
+        # Every request goes through here rather than over the service's own http,
+        # which is shared with the other handler instances using the cached service
+        with self._borrow_http() as http:
+            return request.execute(http=http)
 
-        # Get the remaining messsages, if any
-        if len(messages) % self.max_batch_size > 0:
-            self._get_messages(data, messages[total_pages * self.max_batch_size:])
+    def _submit_page(self, executor, method, params, page_token, left):
+        params['pageToken'] = page_token
+        params['maxResults'] = min(left, self.max_page_size)
 
-    def call_gmail_api(self, method_name: str = None, params: dict = None) -> pd.DataFrame:
+        log.logger.debug(f'Calling Gmail API: list_messages with params ({params})')
+        return executor.submit(self._execute, method(**params))
+
+    def call_gmail_api(self, method_name: str = None, params: dict = None, columns: List[str] = None) -> pd.DataFrame:
         """Call Gmail API and map the data to pandas DataFrame
         Args:
             method_name (str): method name
             params (dict): query parameters
+            columns (List[str]): columns to fetch, all columns by default
         Returns:
             DataFrame
         """
         service = self.connect()
+        messages = service.users().messages()
         if method_name == 'list_messages':
-            method = service.users().messages().list
+            method = messages.list
         elif method_name == 'send_message':
-            method = service.users().messages().send
+            method = messages.send
         else:
             raise NotImplementedError(f'Unknown method_name: {method_name}')
 
-        left = None
+        params['userId'] = 'me'
+
+        if method_name == 'send_message':
+            log.logger.debug(f'Calling Gmail API: {method_name} with params ({params})')
+            return pd.DataFrame([self._execute(method(**params))])
+
         count_results = None
         if 'maxResults' in params:
             count_results = params['maxResults']
+            params['maxResults'] = min(count_results, self.max_page_size)
 
-        params['userId'] = 'me'
+        data = self._new_columns()
+        if count_results == 0:
+            return pd.DataFrame(data)
 
-        data = []
+        message_format = self._get_message_format(columns)
         limit_exec_time = time.time() + 60
 
-        while True:
-            if time.time() > limit_exec_time:
-                raise RuntimeError('Handler request timeout error')
-
-            if count_results is not None:
-                left = count_results - len(data)
-                if left == 0:
-                    break
-                elif left < 0:
-                    # got more results that we need
-                    data = data[:left]
-                    break
-
-                if left > self.max_page_size:
-                    params['maxResults'] = self.max_page_size
-                else:
-                    params['maxResults'] = left
-
+        # The next page is listed in the background while the messages of the
+        # current page are being fetched, so the two round trips overlap
+        with ThreadPoolExecutor(max_workers=1) as executor:
             log.logger.debug(f'Calling Gmail API: {method_name} with params ({params})')
+            future = executor.submit(self._execute, method(**params))
 
-            resp = method(**params).execute()
+            while future is not None:
+                if time.time() > limit_exec_time:
+                    raise RuntimeError('Handler request timeout error')
 
-            if 'messages' in resp:
-                self._handle_list_messages_response(data, resp['messages'])
-            elif isinstance(resp, dict):
-                data.append(resp)
+                resp = future.result()
+                future = None
 
-            if count_results is not None and 'nextPageToken' in resp:
-                params['pageToken'] = resp['nextPageToken']
-            else:
-                break
+                messages = resp.get('messages', [])
+                if count_results is not None:
+                    # Never fetch more messages than are still needed
+                    messages = messages[:count_results - len(data['id'])]
+
+                # The next page is requested assuming every message of this page will be fetched
+                if count_results is not None and 'nextPageToken' in resp:
+                    left = count_results - len(data['id']) - len(messages)
+                    if left > 0:
+                        future = self._submit_page(executor, method, params, resp['nextPageToken'], left)
+
+                self._handle_list_messages_response(data, messages, message_format)
 
-        df = pd.DataFrame(data)
+                # Some messages of this page couldn't be fetched, so the next page is needed after all
+                if future is None and count_results is not None and 'nextPageToken' in resp:
+                    left = count_results - len(data['id'])
+                    if left > 0:
+                        future = self._submit_page(executor, method, params, resp['nextPageToken'], left)
 
-        return df
+        return pd.DataFrame(data)
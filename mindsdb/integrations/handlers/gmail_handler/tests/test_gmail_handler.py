@@ -1,5 +1,17 @@
 from mindsdb.integrations.handlers.gmail_handler.gmail_handler import GmailHandler
 from mindsdb.api.mysql.mysql_proxy.libs.constants.response_type import RESPONSE_TYPE
+from mindsdb.integrations.handlers.gmail_handler import gmail_handler
+from mindsdb_sql import parse_sql
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from google.auth import _helpers
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+from unittest.mock import MagicMock, patch
+import os
+import pandas as pd
+import tempfile
 import unittest
 
 
@@ -46,5 +58,374 @@ class EmailsTableTest(unittest.TestCase):
         self.assertListEqual(columns, expected_columns)
 
 
+def _encode(text):
+    return urlsafe_b64encode(text.encode()).decode()
+
+
+class FakeBatch:
+    """Stands in for googleapiclient's BatchHttpRequest"""
+
+    def __init__(self, answer, callback=None):
+        self.answer = answer
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id))
+
+    def execute(self, http=None):
+        for request, callback, request_id in self.requests:
+            callback(request_id, *self.answer(request))
+
+
+class MockedServiceTest(unittest.TestCase):
+    """Runs the handler against a mocked Gmail service, which answers every get with a message"""
+
+    def setUp(self):
+        self.handler = GmailHandler('test_gmail_handler', connection_data={})
+        self.fetched = []
+        self.failing = set()
+        # Number of times each message is rate limited before it is returned
+        self.rate_limited = {}
+
+        self.service = MagicMock()
+        self.messages = self.service.users.return_value.messages.return_value
+        self.messages.get.side_effect = lambda **kwargs: kwargs
+        self.service.new_batch_http_request.side_effect = lambda callback=None: FakeBatch(self.answer, callback)
+
+        self.handler.service = self.service
+        self.handler.is_connected = True
+        self.handler._execute = lambda request: request.execute()
+
+    def answer(self, request):
+        message_id = request['id']
+        message_format = request.get('format', 'full')
+        self.fetched.append((message_id, message_format))
+
+        if message_id in self.failing:
+            return None, HttpError(Response({'status': 404}), b'Requested entity was not found.')
+
+        if self.rate_limited.get(message_id):
+            self.rate_limited[message_id] -= 1
+            return None, HttpError(Response({'status': 429}), b'Too many concurrent requests for user')
+
+        message = {
+            'id': message_id,
+            'threadId': 't' + message_id,
+            'labelIds': [message_format.upper()],
+            'historyId': '1',
+        }
+        if message_format != 'minimal':
+            message['payload'] = {'headers': [{'name': 'Subject', 'value': 'subject ' + message_id}]}
+        if message_format == 'full':
+            message['payload']['parts'] = [{'mimeType': 'text/plain', 'body': {'data': _encode('body ' + message_id)}}]
+
+        return message, None
+
+    def mock_list_pages(self, *pages):
+        responses = iter(pages)
+        self.messages.list.return_value.execute.side_effect = lambda: next(responses)
+
+    def list_calls(self):
+        return [call.kwargs for call in self.messages.list.call_args_list]
+
+
+class PaginationTest(MockedServiceTest):
+    def test_failed_messages_taken_from_next_page(self):
+        self.mock_list_pages(
+            {'messages': [{'id': 'a'}, {'id': 'b'}], 'nextPageToken': 'page2'},
+            {'messages': [{'id': 'c'}]},
+        )
+        self.failing.add('b')
+
+        result = self.handler.call_gmail_api('list_messages', {'maxResults': 2})
+
+        self.assertListEqual(list(result['id']), ['a', 'c'])
+        self.assertListEqual([call['maxResults'] for call in self.list_calls()], [2, 1])
+        self.assertEqual(self.list_calls()[1]['pageToken'], 'page2')
+
+    def test_pages_capped_to_limit(self):
+        # The API is made to return more messages than asked for
+        self.mock_list_pages(
+            {'messages': [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}], 'nextPageToken': 'page2'},
+            {'messages': [{'id': 'd'}, {'id': 'e'}, {'id': 'f'}], 'nextPageToken': 'page3'},
+        )
+        self.handler.max_page_size = 3
+
+        result = self.handler.call_gmail_api('list_messages', {'maxResults': 4})
+
+        self.assertListEqual(list(result['id']), ['a', 'b', 'c', 'd'])
+        self.assertListEqual([call['maxResults'] for call in self.list_calls()], [3, 1])
+        self.assertListEqual([message_id for message_id, _ in self.fetched], ['a', 'b', 'c', 'd'])
+
+    def test_no_limit_single_page(self):
+        self.mock_list_pages({'messages': [{'id': 'a'}], 'nextPageToken': 'page2'})
+
+        result = self.handler.call_gmail_api('list_messages', {})
+
+        self.assertListEqual(list(result['id']), ['a'])
+        self.assertEqual(self.messages.list.call_count, 1)
+
+    def test_limit_zero(self):
+        result = self.handler.call_gmail_api('list_messages', {'maxResults': 0})
+
+        self.assertEqual(len(result), 0)
+        self.messages.list.assert_not_called()
+
+    def test_no_messages(self):
+        self.mock_list_pages({'resultSizeEstimate': 0})
+
+        result = self.handler.call_gmail_api('list_messages', {'maxResults': 10})
+
+        self.assertEqual(len(result), 0)
+        self.assertListEqual(list(result.columns), self.handler.emails.get_columns())
+
+
+@patch.object(gmail_handler.time, 'sleep')
+class RateLimitTest(MockedServiceTest):
+    def get_messages(self, *ids):
+        return self.handler._get_messages([{'id': message_id} for message_id in ids], {'format': 'full'})
+
+    def test_rate_limited_messages_retried(self, sleep):
+        self.rate_limited['b'] = 2
+
+        data = self.get_messages('a', 'b', 'c')
+
+        self.assertCountEqual(data['id'], ['a', 'b', 'c'])
+        self.assertListEqual([message_id for message_id, _ in self.fetched], ['a', 'b', 'c', 'b', 'b'])
+        self.assertListEqual([call.args[0] for call in sleep.call_args_list], [1, 2])
+
+    def test_user_rate_limit_reason_retried(self, sleep):
+        self.assertTrue(gmail_handler._is_rate_limited(
+            HttpError(Response({'status': 403}), b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}')
+        ))
+        self.assertFalse(gmail_handler._is_rate_limited(
+            HttpError(Response({'status': 403}), b'{"error": {"errors": [{"reason": "forbidden"}]}}')
+        ))
+
+    def test_other_errors_not_retried(self, sleep):
+        self.failing.add('b')
+
+        data = self.get_messages('a', 'b')
+
+        self.assertListEqual(data['id'], ['a'])
+        sleep.assert_not_called()
+
+    def test_retries_exhausted(self, sleep):
+        self.rate_limited['b'] = gmail_handler.MAX_RATE_LIMIT_RETRIES + 1
+
+        with self.assertRaises(RuntimeError):
+            self.get_messages('a', 'b')
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        gmail_handler._TOKEN_CACHE.clear()
+        self.handler = GmailHandler('test_gmail_handler', connection_data={})
+        self.curr_dir = tempfile.mkdtemp()
+        self.token_file = os.path.join(self.curr_dir, 'token.json')
+
+    def tearDown(self):
+        gmail_handler._TOKEN_CACHE.clear()
+
+    def make_credentials(self, expires_in=3600):
+        return Credentials(
+            token='token',
+            refresh_token='refresh',
+            client_id='client_id',
+            client_secret='client_secret',
+            token_uri='https://oauth2.googleapis.com/token',
+            expiry=_helpers.utcnow() + timedelta(seconds=expires_in)
+        )
+
+    def create_connection(self):
+        with patch.object(gmail_handler, '__file__', os.path.join(self.curr_dir, 'gmail_handler.py')), \
+                patch('googleapiclient.discovery.build'), \
+                patch('google_auth_oauthlib.flow.InstalledAppFlow') as flow, \
+                patch.object(Credentials, 'refresh') as refresh:
+            self.handler.create_connection()
+
+        flow.from_client_secrets_file.assert_not_called()
+        return refresh
+
+    def test_scopes(self):
+        scope = 'https://www.googleapis.com/auth/gmail.readonly'
+
+        self.assertTupleEqual(self.handler.scopes, gmail_handler.DEFAULT_SCOPES)
+        self.assertTupleEqual(GmailHandler('test_gmail_handler', connection_data={'scopes': [scope]}).scopes, (scope,))
+        self.assertTupleEqual(GmailHandler('test_gmail_handler', connection_data={'scopes': scope}).scopes, (scope,))
+
+    def test_unchanged_token_not_written(self):
+        creds = self.make_credentials()
+        self.handler._save_token(self.token_file, creds)
+
+        with patch.object(gmail_handler, 'open', create=True, side_effect=open) as mocked_open:
+            self.handler._save_token(self.token_file, creds)
+            mocked_open.assert_not_called()
+
+            creds.token = 'new_token'
+            self.handler._save_token(self.token_file, creds)
+            mocked_open.assert_called_once()
+
+    def test_token_loaded_once(self):
+        self.handler._save_token(self.token_file, self.make_credentials())
+        gmail_handler._TOKEN_CACHE.clear()
+
+        creds = self.handler._load_token(self.token_file)
+
+        self.assertEqual(creds.token, 'token')
+        self.assertIs(self.handler._load_token(self.token_file), creds)
+
+    def test_valid_token_not_refreshed(self):
+        with open(self.token_file, 'w') as token:
+            token.write(self.make_credentials().to_json())
+
+        self.create_connection().assert_not_called()
+
+    def test_expiring_token_refreshed(self):
+        # google-auth already treats tokens expiring within a few minutes as expired
+        with open(self.token_file, 'w') as token:
+            token.write(self.make_credentials(expires_in=90).to_json())
+
+        self.create_connection().assert_called_once()
+
+
+class PartsTest(unittest.TestCase):
+    def test_iter_parts_order(self):
+        parts = [
+            {'mimeType': 'text/plain', 'id': 1},
+            {'mimeType': 'multipart/mixed', 'parts': [
+                {'mimeType': 'text/plain', 'id': 2},
+                {'mimeType': 'multipart/alternative', 'parts': [
+                    {'mimeType': 'text/plain', 'id': 3},
+                    {'mimeType': 'text/html', 'id': 4},
+                ]},
+            ]},
+            {'mimeType': 'application/pdf', 'id': 5},
+        ]
+
+        ids = [part['id'] for part in gmail_handler._iter_parts(parts)]
+
+        self.assertListEqual(ids, [1, 2, 3, 4, 5])
+
+    def test_parse_parts(self):
+        handler = GmailHandler('test_gmail_handler', connection_data={})
+        parts = [
+            {'mimeType': 'text/plain', 'body': {'data': _encode('Hello ')}},
+            {'mimeType': 'multipart/alternative', 'parts': [
+                {'mimeType': 'text/plain', 'body': {'data': _encode('world')}},
+            ]},
+            {'mimeType': 'multipart/mixed'},
+            {'mimeType': 'application/pdf', 'filename': 'a.pdf', 'body': {'attachmentId': 'att'}},
+        ]
+        attachments = []
+
+        body = handler._parse_parts(parts, attachments)
+
+        self.assertEqual(body, 'Hello world')
+        self.assertListEqual(attachments, [{'filename': 'a.pdf', 'mimeType': 'application/pdf', 'attachmentId': 'att'}])
+
+
+class MessageFormatTest(MockedServiceTest):
+    def test_full_format(self):
+        self.assertEqual(self.handler._get_message_format(None)['format'], 'full')
+        self.assertEqual(self.handler._get_message_format(['id', 'body'])['format'], 'full')
+        self.assertEqual(self.handler._get_message_format(['attachments'])['format'], 'full')
+
+    def test_minimal_format(self):
+        self.assertEqual(self.handler._get_message_format(['id'])['format'], 'minimal')
+        self.assertEqual(self.handler._get_message_format(['id', 'thread_id', 'label_ids'])['format'], 'minimal')
+
+    def test_metadata_format(self):
+        message_format = self.handler._get_message_format(['id', 'subject'])
+
+        self.assertEqual(message_format['format'], 'metadata')
+        self.assertListEqual(message_format['metadataHeaders'], gmail_handler.METADATA_HEADERS)
+
+    def test_messages_fetched_in_format(self):
+        self.mock_list_pages({'messages': [{'id': 'a'}]})
+
+        result = self.handler.call_gmail_api('list_messages', {}, columns=['id', 'subject'])
+
+        self.assertListEqual(self.fetched, [('a', 'metadata')])
+        self.assertListEqual(list(result['subject']), ['subject a'])
+
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = GmailHandler('test_gmail_handler', connection_data={})
+        self.handler.call_gmail_api = MagicMock(return_value=pd.DataFrame({
+            column: ['value'] for column in self.handler.emails.get_columns()
+        }))
+
+    def test_aliases(self):
+        query = parse_sql('SELECT Subject AS title, id FROM emails', dialect='mindsdb')
+
+        result = self.handler.emails.select(query)
+
+        self.assertListEqual(list(result.columns), ['title', 'id'])
+        self.assertListEqual(self.handler.call_gmail_api.call_args.kwargs['columns'], ['subject', 'id'])
+
+    def test_absent_columns(self):
+        query = parse_sql('SELECT id, unknown FROM emails', dialect='mindsdb')
+
+        result = self.handler.emails.select(query)
+
+        self.assertListEqual(list(result.columns), ['id', 'unknown'])
+        self.assertTrue(result['unknown'].isna().all())
+
+
+@patch.object(gmail_handler.time, 'sleep')
+class MessageCacheTest(MockedServiceTest):
+    def get_messages(self, *ids, message_format='full'):
+        return self.handler._get_messages([{'id': message_id} for message_id in ids], {'format': message_format})
+
+    def test_cached_messages_are_refreshed(self, sleep):
+        self.get_messages('a', 'b')
+        self.fetched.clear()
+
+        data = self.get_messages('a', 'c')
+
+        self.assertListEqual(self.fetched, [('a', 'minimal'), ('c', 'full')])
+        self.assertListEqual(data['id'], ['a', 'c'])
+        self.assertListEqual(data['body'], ['body a', 'body c'])
+        # Labels come from the refresh, the content from the cache
+        self.assertListEqual(data['label_ids'], [['MINIMAL'], ['FULL']])
+        self.assertEqual(data['subject'][0], 'subject a')
+
+    def test_rate_limited_refresh_retried(self, sleep):
+        self.get_messages('a')
+        self.fetched.clear()
+        self.rate_limited['a'] = 1
+
+        data = self.get_messages('a')
+
+        self.assertListEqual(self.fetched, [('a', 'minimal'), ('a', 'minimal')])
+        self.assertListEqual(data['body'], ['body a'])
+
+    def test_least_recently_used_evicted(self, sleep):
+        self.handler.max_cached_messages = 2
+
+        self.get_messages('a', 'b')
+        self.get_messages('a')
+        self.get_messages('c')
+
+        self.assertListEqual(list(self.handler._message_cache), ['a', 'c'])
+
+    def test_size_bound(self, sleep):
+        self.get_messages('a')
+        self.handler.max_cached_size = self.handler._message_cache_size
+        self.get_messages('b')
+
+        self.assertListEqual(list(self.handler._message_cache), ['b'])
+        self.assertLessEqual(self.handler._message_cache_size, self.handler.max_cached_size)
+
+    def test_only_full_format_cached(self, sleep):
+        self.get_messages('a', message_format='minimal')
+        self.get_messages('b', message_format='metadata')
+
+        self.assertEqual(len(self.handler._message_cache), 0)
+
+
 if __name__ == '__main__':
     unittest.main()